@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+"""
+Fingerprinted, precompressed static assets
+
+Running this module (done by *start* before launching the server)
+copies every file in *static/* to *static/dist/* with a hash of its
+contents in the name (*css/main.css* -> *css/main.HASH.css*), next to
+gzip and (if the :mod:`brotli` module is available) brotli
+compressed versions, and writes *static/dist/manifest.json* mapping
+the original names to the hashed ones::
+
+  $ python assets.py
+
+When the manifest exists, :func:`init_app` makes *url_for('static',
+filename = NAME)* in templates point to the hashed copy under
+*/assets/*, which is served compressed when the client accepts it and
+with headers telling it to cache it forever--since the name changes
+when the contents do, it never goes stale.
+"""
+import gzip
+import json
+import logging
+import mimetypes
+import os
+import shutil
+import sys
+
+import flask
+import werkzeug.security
+
+import db
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# a year; what browsers take as forever
+max_age = 365 * 24 * 60 * 60
+
+# ( extension, Content-Encoding ), in order of preference
+encodings = [ ( '.br', 'br' ), ( '.gz', 'gzip' ) ]
+
+def _compress(filename, data):
+    # only keep compressed versions that are smaller; there is no
+    # point on compressing already compressed formats (eg: PNG)
+    compressed = gzip.compress(data, compresslevel = 9, mtime = 0)
+    if len(compressed) < len(data):
+        with open(filename + ".gz", "wb") as f:
+            f.write(compressed)
+    if brotli:
+        compressed = brotli.compress(data)
+        if len(compressed) < len(data):
+            with open(filename + ".br", "wb") as f:
+                f.write(compressed)
+
+def build(static_dir, dist_dir = None):
+    """
+    Create fingerprinted and compressed copies of the files in
+    *static_dir*
+
+    :param str static_dir: directory with the static files
+    :param str dist_dir: (optional) directory where to place the
+      copies and the manifest; defaults to *STATIC_DIR/dist* (which
+      is skipped when scanning *static_dir*); it is wiped first.
+    :returns dict: manifest, mapping the name of each file (relative
+      to *static_dir*) to its fingerprinted name
+    """
+    if dist_dir == None:
+        dist_dir = os.path.join(static_dir, "dist")
+    shutil.rmtree(dist_dir, ignore_errors = True)
+    db.makedirs_p(dist_dir, reason = "static assets")
+    manifest = {}
+    for rootname, dirnames, filenames in os.walk(static_dir):
+        if os.path.abspath(rootname) == os.path.abspath(dist_dir):
+            dirnames[:] = []
+            continue
+        for filename in filenames:
+            path = os.path.join(rootname, filename)
+            name = os.path.relpath(path, static_dir).replace(os.sep, "/")
+            with open(path, "rb") as f:
+                data = f.read()
+            base, ext = os.path.splitext(name)
+            name_hashed = base + "." + db.mkid(data, 12) + ext
+            path_hashed = os.path.join(dist_dir, name_hashed)
+            db.makedirs_p(os.path.dirname(path_hashed),
+                          reason = "static assets")
+            with open(path_hashed, "wb") as f:
+                f.write(data)
+            _compress(path_hashed, data)
+            manifest[name] = name_hashed
+    with open(os.path.join(dist_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent = 2, sort_keys = True)
+    return manifest
+
+def url_for(endpoint, **values):
+    """
+    Same as :func:`flask.url_for`, but static files listed in the
+    manifest point to their fingerprinted copy under */assets/*
+    """
+    if endpoint == 'static':
+        manifest = flask.current_app.extensions['assets']
+        name_hashed = manifest.get(values.get('filename', None), None)
+        if name_hashed:
+            endpoint = 'assets'
+            values['filename'] = name_hashed
+    return flask.url_for(endpoint, **values)
+
+def _serve(filename):
+    dist_dir = os.path.join(flask.current_app.static_folder, "dist")
+    mimetype, _ = mimetypes.guess_type(filename)
+    accepted = flask.request.accept_encodings
+    for ext, encoding in encodings:
+        if accepted[encoding] <= 0:
+            continue
+        # safe_join() so we don't go outside dist_dir
+        path = werkzeug.security.safe_join(dist_dir, filename + ext)
+        if path and os.path.isfile(path):
+            response = flask.send_from_directory(
+                dist_dir, filename + ext,
+                mimetype = mimetype, max_age = max_age)
+            response.headers['Content-Encoding'] = encoding
+            break
+    else:
+        response = flask.send_from_directory(
+            dist_dir, filename, mimetype = mimetype, max_age = max_age)
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+def init_app(app):
+    """
+    Serve fingerprinted assets from */assets/* and override
+    *url_for()* in templates to use them
+
+    If :func:`build` has not been run, this does nothing and the
+    files are served as usual from */static/*. Same for files
+    modified after it was run, with a warning, so stale copies are
+    not served (and cached forever).
+    """
+    manifest_path = os.path.join(app.static_folder, "dist", "manifest.json")
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        manifest_mtime = os.stat(manifest_path).st_mtime
+    except FileNotFoundError:
+        manifest = {}
+    for name in list(manifest):
+        try:
+            mtime = os.stat(os.path.join(app.static_folder, name)).st_mtime
+        except FileNotFoundError:
+            mtime = None
+        if mtime == None or mtime > manifest_mtime:
+            logging.warning(
+                "assets: %s: modified after %s was built, serving from"
+                " /static; run assets.py to update", name, manifest_path)
+            del manifest[name]
+    app.extensions['assets'] = manifest
+    if not manifest:
+        return
+    app.add_url_rule('/assets/<path:filename>', 'assets', _serve)
+    app.jinja_env.globals['url_for'] = url_for
+
+if __name__ == "__main__":
+    static_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              "static")
+    if len(sys.argv) > 1:
+        static_dir = sys.argv[1]
+    for name, name_hashed in sorted(build(static_dir).items()):
+        print(f"{name} -> {name_hashed}")
@@ -10,8 +10,6 @@ import os
 import stat
 import logging
 
-logging.basicConfig(encoding='utf-8', level=logging.DEBUG)
-
 class driver():
     """Authenticate users from a local database directory
 
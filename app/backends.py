@@ -0,0 +1,86 @@
+import threading
+
+import auth_userdb
+import db
+import fragment_cache
+
+class backends_c(object):
+    """
+    Databases and caches used by the application, created the first
+    time they are needed
+
+    So importing the application or creating it (see
+    :func:`movies.create_app`) doesn't touch the filesystem; this
+    also allows rebuilding them in a process that was forked after
+    they were used (see :meth:`reinit`).
+
+    :param dict config: application configuration; uses *FSDB*,
+      *USERDB* and *FRAGMENT_CACHE_BYTES*
+    """
+    def __init__(self, config):
+        self.config = config
+        self._lock = threading.Lock()
+        self._fsdb = None
+        self._userdb = None
+        self._fragments = None
+        #: ( GENERATION, UNSEEN, WATCHED ) movie lists last read from
+        #: the database, see :func:`movies.movies_split`
+        self.movies_lists = None
+
+    def __repr__(self):
+        return "backends (fsdb @%s, userdb @%s)" % (
+            self.config['FSDB'], self.config['USERDB'])
+
+    @property
+    def fsdb(self):
+        """
+        Movie database (:class:`db.fsdb_symlink_c`)
+        """
+        if self._fsdb == None:
+            with self._lock:
+                if self._fsdb == None:
+                    self._fsdb = db.fsdb_symlink_c(self.config['FSDB'])
+        return self._fsdb
+
+    @property
+    def userdb(self):
+        """
+        User/password database (:class:`auth_userdb.driver`)
+        """
+        if self._userdb == None:
+            with self._lock:
+                if self._userdb == None:
+                    self._userdb = auth_userdb.driver(self.config['USERDB'])
+        return self._userdb
+
+    @property
+    def fragments(self):
+        """
+        Rendered movie lists, so we don't go over the template loops
+        on every request unless the database changed
+        (:class:`fragment_cache.fragment_cache_c`)
+        """
+        if self._fragments == None:
+            with self._lock:
+                if self._fragments == None:
+                    self._fragments = fragment_cache.fragment_cache_c(
+                        int(self.config['FRAGMENT_CACHE_BYTES']))
+        return self._fragments
+
+    def reinit(self):
+        """
+        Prepare for use in a process forked from the one that created
+        this object
+
+        Locks are recreated, since they might have been held by a
+        thread that does not exist in the child; the databases are
+        dropped so they are recreated for the new process (eg: the
+        fsdb's *uuid* depends on the PID). Cached fragments and movie
+        lists are kept; that's the point of filling them before
+        forking.
+        """
+        self._lock = threading.Lock()
+        self._fsdb = None
+        self._userdb = None
+        if self._fragments != None:
+            self._fragments.reinit()
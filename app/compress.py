@@ -0,0 +1,61 @@
+"""
+Gzip compression of dynamic responses
+
+:func:`init_app` hooks an *after_request* handler that, for textual
+responses of at least *min_size* bytes (or streamed, whose size is
+not known) to clients that accept *gzip*, replaces the body with an
+iterator that compresses it as it is sent, so it is never held
+compressed in memory in full.
+
+Files (eg: static assets) are left alone; see :mod:`assets` for those.
+"""
+import zlib
+
+import flask
+
+# mimetypes worth compressing
+mimetypes = [ 'text/html', 'text/plain', 'application/json' ]
+
+def _gzip_iter(iterable, original, level):
+    # wbits 16 + MAX_WBITS => write a gzip header and trailer
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    try:
+        for data in iterable:
+            compressed = compressor.compress(data)
+            if compressed:
+                yield compressed
+        yield compressor.flush()
+    finally:
+        # the response would have closed the original iterable
+        # (eg: to end a streaming template); we replaced it
+        if hasattr(original, "close"):
+            original.close()
+
+def init_app(app, min_size = 1024, level = 6):
+    """
+    Compress dynamic responses of *app* when the client allows it
+
+    :param flask.Flask app: application
+    :param int min_size: (optional) do not compress non-streamed
+      responses smaller than this many bytes
+    :param int level: (optional) :mod:`zlib` compression level (1-9)
+    """
+    @app.after_request
+    def _compress(response):
+        if response.direct_passthrough \
+           or response.status_code < 200 \
+           or response.status_code in ( 204, 304 ) \
+           or 'Content-Encoding' in response.headers \
+           or response.mimetype not in mimetypes:
+            return response
+        response.vary.add('Accept-Encoding')
+        if flask.request.accept_encodings['gzip'] <= 0:
+            return response
+        if not response.is_streamed \
+           and response.calculate_content_length() < min_size:
+            return response
+        response.response = _gzip_iter(response.iter_encoded(),
+                                       response.response, level)
+        response.headers['Content-Encoding'] = 'gzip'
+        response.headers.pop('Content-Length', None)
+        return response
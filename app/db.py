@@ -1,13 +1,16 @@
+import bisect
 import os
 import hashlib
+import sys
 import base64
-import urllib
+import urllib.parse
 import string
 import numbers
 import threading
 import errno
 import fnmatch
 import json
+import collections.abc
 
 def makedirs_p(dirname, mode = None, reason = None):
     """
@@ -31,6 +34,18 @@ def makedirs_p(dirname, mode = None, reason = None):
             raise RuntimeError("%s: path for %s does not allow writes: %s"
                                % (dirname, reason, e))
 
+def _key_rep(r, key, key_flat, val):
+    # put val in r[key] if key is already fully expanded (it has no
+    # periods); otherwise expand it recursively
+    if '.' in key:
+        lhs, rhs = key.split('.', 1)
+        if not isinstance(r.get(lhs, None), dict):
+            # not there or a leaf value we need to override
+            r[lhs] = {}
+        _key_rep(r[lhs], rhs, key_flat, val)
+    else:
+        r[key] = val
+
 def flat_keys_to_dict(d):
     """
     Given a dictionary of flat keys, convert it to a nested dictionary
@@ -74,6 +89,127 @@ def flat_keys_to_dict(d):
 
     return tr
 
+def dict_to_flat_keys(d, prefix = ""):
+    """
+    Given a nested dictionary, generate its flat keys and values
+
+    This is the inverse of :func:`flat_keys_to_dict`; it walks *d*
+    depth first and yields each leaf as it goes, without building
+    the whole flat dictionary in memory:
+
+    >>> list(dict_to_flat_keys({ 'a': { 'b': { 'c': 34 } } }))
+    [('a.b.c', 34)]
+
+    :param dict d: (nested) dictionary; any
+      :class:`collections.abc.Mapping` will do (eg:
+      :class:`fsdb_view_c`)
+    :param str prefix: (optional) prefix to prepend to each key
+    :returns: iterator of *(KEY, VALUE)*
+    """
+    for key, value in d.items():
+        key_flat = prefix + str(key)
+        if isinstance(value, collections.abc.Mapping):
+            yield from dict_to_flat_keys(value, key_flat + ".")
+        else:
+            yield key_flat, value
+
+class fsdb_view_c(collections.abc.Mapping):
+    """
+    Read-only nested view over the flat keys of a :class:`fsdb_c`
+
+    Behaves like the dictionary :func:`flat_keys_to_dict` would
+    return for the database, but values are not read until asked
+    for:
+
+    >>> view = fsdb_view_c(fsdb)
+    >>> view['a']['b']
+
+    The keys are listed once, the first time the view needs them,
+    and grouped by their first field; intermediate levels are
+    returned as another view that gets its part of that listing, so
+    going down doesn't list the database again. Same as
+    :func:`flat_keys_to_dict`, if *a.b* is set and so are *a.b.c*,
+    the latter wins and *view['a']['b']* is a view.
+
+    Note the set of keys is the one at the time of listing; each
+    value is read once, the first time it is accessed or the view
+    iterated over. Keys removed since they were listed are skipped
+    when iterating (and raise :exc:`KeyError` when accessed), so
+    walking the view while the database changes doesn't fail.
+
+    :param fsdb_c fsdb: database to look at
+    :param str prefix: (optional) only look at keys starting with
+      *PREFIX.* (the period is added if missing); defaults to the
+      whole database
+    :param list(str) keys: (optional) keys under *prefix* (with the
+      prefix removed), if already known; otherwise the database is
+      listed
+    """
+    def __init__(self, fsdb, prefix = "", keys = None):
+        assert isinstance(fsdb, fsdb_c)
+        assert isinstance(prefix, str)
+        if prefix and not prefix.endswith("."):
+            prefix += "."
+        self.fsdb = fsdb
+        self.prefix = prefix
+        self._keys = keys
+        self._levels = None
+        self._values = {}
+
+    def __repr__(self):
+        return "fsdb view @%s[%s]" % (self.fsdb.location, self.prefix)
+
+    def _levels_get(self):
+        # map each field at this level to the list of its subkeys
+        # (without the FIELD. prefix); empty if it is a leaf
+        if self._levels != None:
+            return self._levels
+        keys = self._keys
+        if keys == None:
+            prefix_len = len(self.prefix)
+            keys = [ key[prefix_len:] for key in self.fsdb.keys()
+                     if key.startswith(self.prefix) ]
+        levels = {}
+        for key in keys:
+            if '.' in key:
+                lhs, rhs = key.split('.', 1)
+                levels.setdefault(lhs, []).append(rhs)
+            else:
+                levels.setdefault(key, [])
+        self._levels = levels
+        self._keys = None
+        return levels
+
+    def _value_get(self, field):
+        # read a leaf value once; None (and forget the field) if it
+        # was removed since listed
+        if field in self._values:
+            return self._values[field]
+        value = self.fsdb.get(self.prefix + field)
+        if value == None:
+            self._levels_get().pop(field, None)
+        else:
+            self._values[field] = value
+        return value
+
+    def __getitem__(self, key):
+        subkeys = self._levels_get()[key]
+        if subkeys:
+            return fsdb_view_c(self.fsdb, self.prefix + key + ".", subkeys)
+        value = self._value_get(key)
+        if value == None:
+            raise KeyError(key)
+        return value
+
+    def __iter__(self):
+        # list() as _value_get() might drop fields while we go
+        for field, subkeys in list(self._levels_get().items()):
+            if subkeys or self._value_get(field) != None:
+                yield field
+
+    def __len__(self):
+        return len(self._levels_get())
+
 def rm_f(filename):
     """
     Remove a file (not a directory) unconditionally, ignore errors if
@@ -197,6 +333,18 @@ class fsdb_c(object):
         """
         raise NotImplementedError
 
+    def generation(self):
+        """
+        Return a value that changes whenever the database is modified
+
+        Meant to be used as part of cache keys: if the generation is
+        the same as when something was computed from the database,
+        the database has not changed since.
+
+        :returns: hashable object; compare only for equality
+        """
+        raise NotImplementedError
+
     @staticmethod
     def create(cache_dir):
         """
@@ -227,6 +375,14 @@ class fsdb_symlink_c(fsdb_c):
     class invalid_e(fsdb_c.exception):
         pass
 
+    #: Prefix for the temporary entries :meth:`set` creates and then
+    #: renames over the final one; keys are quoted into filenames
+    #: with :func:`urllib.parse.quote`, which never generates a *%*
+    #: not followed by two hex digits, so this can't collide with a
+    #: key--and it allows :meth:`keys` and friends to skip them if
+    #: they list the directory in the middle of a :meth:`set`.
+    tmp_prefix = "%tmp-"
+
     def __init__(self, dirname, use_uuid = None, concept = "directory"):
         """
         Initialize the database to be saved in the give location
@@ -247,6 +403,9 @@ class fsdb_symlink_c(fsdb_c):
             self.uuid = use_uuid
 
         self.location = dirname
+        #: Number of :meth:`set` calls done through this object; part
+        #: of :meth:`generation`
+        self.writes = 0
 
     def _raw_valid(self, location):
         return os.path.islink(location)
@@ -267,11 +426,29 @@ class fsdb_symlink_c(fsdb_c):
     def _raw_stat(location):
         return os.lstat(location)
 
+    def generation(self):
+        # every set() creates, renames or removes a directory entry,
+        # which updates the directory's modification and change
+        # times; this works across processes, as long as the
+        # filesystem's timestamps are fine grained (nanoseconds in
+        # most modern ones).
+        #
+        # With coarse timestamps (eg: FAT, some network
+        # filesystems) two writes in the same tick look the same;
+        # the write counter covers the writes done by this process
+        # (so a user always sees their own changes), but writes from
+        # other processes in the same tick won't show until the
+        # next one.
+        st = os.stat(self.location)
+        return ( st.st_ino, st.st_mtime_ns, st.st_ctime_ns, self.writes )
+
     def keys(self, pattern = None):
         l = []
         for _rootname, _dirnames, filenames_raw in os.walk(self.location):
             filenames = []
             for filename_raw in filenames_raw:
+                if filename_raw.startswith(self.tmp_prefix):
+                    continue
                 # need to filter with the unquoted name...
                 filename = urllib.parse.unquote(filename_raw)
                 if pattern == None or fnmatch.fnmatch(filename, pattern):
@@ -284,6 +461,8 @@ class fsdb_symlink_c(fsdb_c):
         for _rootname, _dirnames, filenames_raw in os.walk(self.location):
             filenames = {}
             for filename in filenames_raw:
+                if filename.startswith(self.tmp_prefix):
+                    continue
                 filenames[urllib.parse.unquote(filename)] = filename
             if patterns:	# that means no args given
                 use = {}
@@ -294,7 +473,9 @@ class fsdb_symlink_c(fsdb_c):
                 use = filenames
             for filename, filename_raw in use.items():
                 if self._raw_valid(os.path.join(self.location, filename_raw)):
-                    bisect.insort(fl, ( filename, self._get_raw(filename_raw) ))
+                    value = self._get_raw(filename_raw)
+                    if value != None:	# None: removed since listed
+                        bisect.insort(fl, ( filename, value ))
         return fl
 
     def get_as_dict(self, *patterns):
@@ -302,6 +483,8 @@ class fsdb_symlink_c(fsdb_c):
         for _rootname, _dirnames, filenames_raw in os.walk(self.location):
             filenames = {}
             for filename in filenames_raw:
+                if filename.startswith(self.tmp_prefix):
+                    continue
                 filenames[urllib.parse.unquote(filename)] = filename
             if patterns:	# that means no args given
                 use = {}
@@ -312,10 +495,20 @@ class fsdb_symlink_c(fsdb_c):
                 use = filenames
             for filename, filename_raw in use.items():
                 if self._raw_valid(os.path.join(self.location, filename_raw)):
-                    d[filename] = self._get_raw(filename_raw)
+                    value = self._get_raw(filename_raw)
+                    if value != None:	# None: removed since listed
+                        d[filename] = value
         return d
 
     def set(self, key, value, force = True):
+        try:
+            return self._set(key, value, force)
+        finally:
+            # after the change is done, so a generation() taken
+            # before it is not mistaken for one taken after
+            self.writes += 1
+
+    def _set(self, key, value, force):
         # escape out slashes and other unsavory characters in a non
         # destructive way that won't work as a filename
         key_orig = key
@@ -380,7 +573,14 @@ class fsdb_symlink_c(fsdb_c):
         # collision if more than one process is trying to modify
         # at the same time; they can override each other, that's
         # ok--the last one wins.
-        location_new = location + "-" + str(os.getpid()) + "-" + str(threading.get_ident())
+        #
+        # PID and thread ID make it unique among the threads and
+        # processes alive now; IDs might be reused once they are
+        # dead, but then rm_f() removes any leftover.
+        location_new = os.path.join(
+            self.location,
+            self.tmp_prefix + str(os.getpid()) + "-"
+            + str(threading.get_ident()) + "-" + key)
         rm_f(location_new)
         self._raw_write(location_new, value)
         self._raw_rename(location_new, location)
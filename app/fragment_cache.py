@@ -0,0 +1,108 @@
+import collections
+import threading
+
+class fragment_cache_c(object):
+    """
+    Cache of pre-rendered HTML fragments
+
+    Entries are kept in least-recently-used order; when the total
+    size of the cached fragments goes over *max_bytes*, the least
+    recently used ones are dropped until it fits again. Each entry
+    also counts :attr:`entry_overhead` bytes against *max_bytes*, so
+    lots of tiny (or empty) fragments can't pile up unbounded.
+
+    Keys are meant to include the database generation (see
+    :meth:`db.fsdb_c.generation`), so when the database changes the
+    old entries are not hit anymore and just age out:
+
+    >>> key = ( fsdb.generation(), 'movies.html', 'unseen' )
+    >>> html = cache.get_or_render(key, render_unseen)
+
+    Safe to use from multiple threads.
+
+    :param int max_bytes: (optional) maximum size of the cached
+      fragments (in UTF-8 encoded bytes, plus the per entry overhead)
+    """
+    #: Approximate memory used by an entry besides the fragment's
+    #: text (key tuple with the generation, string and tuple headers,
+    #: dictionary slot and list node), measured on CPython 3.11
+    entry_overhead = 512
+
+    def __init__(self, max_bytes = 16 * 1024 * 1024):
+        assert isinstance(max_bytes, int) and max_bytes > 0
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "fragment cache (%d entries, %d/%d bytes)" % (
+            len(self._entries), self.size, self.max_bytes)
+
+    def get(self, key, default = None):
+        """
+        Return the fragment cached under *key*
+
+        :param key: hashable key
+        :param default: (optional) value to return if *key* is not
+          cached; defaults to *None*.
+        :returns str: cached fragment or *default*
+        """
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry == None:
+                return default
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, fragment):
+        """
+        Cache a fragment under *key*, replacing any existing one
+
+        Fragments bigger than the whole budget are not cached.
+
+        :param key: hashable key
+        :param str fragment: rendered HTML
+        """
+        assert isinstance(fragment, str)
+        size = len(fragment.encode('utf-8')) + self.entry_overhead
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old != None:
+                self.size -= old[1]
+            if size > self.max_bytes:
+                return
+            self._entries[key] = ( fragment, size )
+            self.size += size
+            while self.size > self.max_bytes:
+                _key, ( _fragment, old_size ) = \
+                    self._entries.popitem(last = False)
+                self.size -= old_size
+
+    def get_or_render(self, key, render_fn):
+        """
+        Return the fragment cached under *key*; if not cached, call
+        *render_fn()* to render it and cache it
+
+        Two threads missing the same key at the same time will both
+        render it; last one wins, which is harmless.
+
+        :param key: hashable key
+        :param callable render_fn: function taking no arguments that
+          returns the fragment (*str*)
+        :returns str: fragment
+        """
+        fragment = self.get(key)
+        if fragment == None:
+            fragment = render_fn()
+            self.set(key, fragment)
+        return fragment
+
+    def reinit(self):
+        """
+        Recreate the lock after forking, keeping the cached fragments
+
+        If another thread held the lock when the process forked, it
+        would stay locked forever in the child.
+        """
+        self._lock = threading.Lock()
@@ -0,0 +1,49 @@
+# gunicorn configuration, see
+# https://docs.gunicorn.org/en/stable/settings.html
+#
+# Workers and threads are sized from the CPUs this process can run
+# on: one worker per CPU, with enough threads each (gthread worker
+# class) for four threads per CPU in total, so a request blocked
+# hashing a password or scanning the movie directory does not block
+# the whole worker. Override with WEB_CONCURRENCY (workers) and
+# THREADS (per worker).
+#
+# Set PRELOAD=true to create the application once in the master
+# process (with its caches filled, see movies.create_app()) and fork
+# the workers from it, so they start faster and share that memory.
+import os
+
+def cpus_available():
+    """
+    Return how many CPUs this process can run on
+
+    Might be less than the CPUs in the machine (eg: when running in
+    a container limited with --cpuset-cpus).
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+bind = os.environ.get('BIND', '0.0.0.0:8080')
+
+worker_class = 'gthread'
+workers = int(os.environ.get('WEB_CONCURRENCY', cpus_available()))
+# most of the time of a request is spent in filesystem system calls,
+# which release the GIL, so each CPU can keep a few requests going;
+# if there are fewer workers than CPUs, each gets more threads
+threads_per_cpu = 4
+threads = int(os.environ.get(
+    'THREADS',
+    max(1, threads_per_cpu * cpus_available() // max(1, workers))))
+# with threads, idle keep-alive connections don't hold a worker
+keepalive = 5
+
+preload_app = os.environ.get('PRELOAD', 'false').lower() == 'true'
+if preload_app:
+    os.environ.setdefault('WARM_UP', 'true')
+
+def post_fork(server, worker):
+    if not server.cfg.preload_app:
+        return
+    # the application was created in the master; this returns it
+    server.app.wsgi().extensions['movies'].reinit()
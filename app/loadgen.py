@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+"""
+Replay session traffic against the application and report latency
+and throughput per route
+
+Traffic is kept in a JSONL file, one request per line::
+
+  {"session": 3, "method": "PUT", "path": "/movies/edit", "json": {"movie": "movie 3-7"}}
+
+*session* groups requests that share cookies and are sent in order;
+*form* (for POST forms) and *json* (for JSON bodies) are optional.
+Sessions start by logging in.
+
+Create some synthetic traffic, with a mix of logins, */movies*,
+*/movies/add*, *PUT /movies/edit* and *DELETE /movies/delete*::
+
+  $ python loadgen.py synthesize -o traffic.jsonl --sessions 200
+
+and replay it with 16 concurrent sessions against a gunicorn
+started just for it (on a scratch movie and user database, using
+*gunicorn.conf.py*; *WEB_CONCURRENCY*, *THREADS*, *PRELOAD* and the
+rest of the configuration are taken from the environment)::
+
+  $ THREADS=8 python loadgen.py replay traffic.jsonl -c 16 --start
+
+or against an already running server with *--url*; note the users
+in the traffic file have to exist there.
+
+For each route, prints how many requests were made, how many
+failed, p50/p95/p99 latency and requests/second.
+"""
+import argparse
+import http.client
+import http.cookies
+import json
+import os
+import queue
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+# ( METHOD, PATH, WEIGHT ) of the requests made after logging in
+mix = [
+    ( 'GET', '/movies', 60 ),
+    ( 'POST', '/movies/add', 20 ),
+    ( 'PUT', '/movies/edit', 12 ),
+    ( 'DELETE', '/movies/delete', 8 ),
+]
+
+def synthesize(sessions, requests_per_session, user, password, seed = None):
+    """
+    Generate synthetic session traffic
+
+    Each session logs in as *user* and then makes
+    *requests_per_session* requests picked from :data:`mix`; movies
+    are edited or deleted only after the session added them.
+
+    :returns: iterator of requests (*dict*)
+    """
+    rng = random.Random(seed)
+    methods_paths = [ ( method, path ) for method, path, _ in mix ]
+    weights = [ weight for _, _, weight in mix ]
+    for session in range(sessions):
+        yield dict(session = session, method = 'POST', path = '/login',
+                   form = dict(username = user, passwd = password))
+        added = []
+        for count in range(requests_per_session):
+            method, path = rng.choices(methods_paths, weights)[0]
+            if path in ( '/movies/edit', '/movies/delete' ) and not added:
+                method, path = 'POST', '/movies/add'
+            request = dict(session = session, method = method, path = path)
+            if path == '/movies/add':
+                movie = f"movie {session}-{count}"
+                added.append(movie)
+                request['form'] = dict(movie = movie)
+            elif path == '/movies/edit':
+                request['json'] = dict(movie = rng.choice(added))
+            elif path == '/movies/delete':
+                request['json'] = dict(movie = added.pop(
+                    rng.randrange(len(added))))
+            yield request
+
+def _session_run(host, port, requests, results):
+    # one connection per session, kept alive; redirects are not
+    # followed so each request measures only its route
+    connection = http.client.HTTPConnection(host, port, timeout = 60)
+    cookies = http.cookies.SimpleCookie()
+    try:
+        for request in requests:
+            headers = { 'Accept-Encoding': 'gzip' }
+            body = None
+            if 'form' in request:
+                body = urllib.parse.urlencode(request['form'])
+                headers['Content-Type'] = 'application/x-www-form-urlencoded'
+            elif 'json' in request:
+                body = json.dumps(request['json'])
+                headers['Content-Type'] = 'application/json'
+            if cookies:
+                headers['Cookie'] = "; ".join(
+                    f"{name}={morsel.value}" for name, morsel in cookies.items())
+            route = request['method'] + " " + request['path'].split("?")[0]
+            ts0 = time.perf_counter()
+            try:
+                connection.request(request['method'], request['path'],
+                                   body = body, headers = headers)
+                response = connection.getresponse()
+                response.read()
+                ok = response.status < 400
+                for cookie in response.msg.get_all('Set-Cookie') or []:
+                    cookies.load(cookie)
+                if response.getheader('Connection', '') == 'close':
+                    connection.close()
+            except ( OSError, http.client.HTTPException ):
+                ok = False
+                connection.close()
+            results.append(( route, time.perf_counter() - ts0, ok ))
+    finally:
+        connection.close()
+
+def replay(url, requests, concurrency):
+    """
+    Replay *requests*, running *concurrency* sessions at the same
+    time
+
+    :returns tuple(list, float): list of *( ROUTE, SECONDS, OK )*
+      for each request and seconds it took to run them all
+    """
+    parsed = urllib.parse.urlsplit(url)
+    sessions = {}
+    for request in requests:
+        sessions.setdefault(request['session'], []).append(request)
+    session_queue = queue.Queue()
+    for session in sessions.values():
+        session_queue.put(session)
+    results = []	# list.append() is thread safe
+
+    def _worker():
+        while True:
+            try:
+                session = session_queue.get_nowait()
+            except queue.Empty:
+                return
+            _session_run(parsed.hostname, parsed.port or 80,
+                         session, results)
+
+    threads = [ threading.Thread(target = _worker, daemon = True)
+                for _ in range(concurrency) ]
+    ts0 = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - ts0
+
+def _percentile(values_sorted, percent):
+    # nearest rank
+    index = max(0, -(-len(values_sorted) * percent // 100) - 1)
+    return values_sorted[int(index)]
+
+def report(results, seconds):
+    """
+    Compute latency and throughput per route
+
+    :returns dict: for each route (and *total*), a dictionary with
+      *requests*, *errors*, *p50*, *p95*, *p99* (milliseconds) and
+      *rps* (requests per second)
+    """
+    routes = {}
+    for route, latency, ok in results:
+        routes.setdefault(route, []).append(( latency, ok ))
+    routes['total'] = [ ( latency, ok ) for _, latency, ok in results ]
+    r = {}
+    for route, entries in routes.items():
+        latencies = sorted(latency for latency, _ in entries)
+        if not latencies:
+            continue
+        r[route] = dict(
+            requests = len(entries),
+            errors = sum(1 for _, ok in entries if not ok),
+            p50 = _percentile(latencies, 50) * 1000,
+            p95 = _percentile(latencies, 95) * 1000,
+            p99 = _percentile(latencies, 99) * 1000,
+            rps = len(entries) / seconds,
+        )
+    return r
+
+def _port_free():
+    with socket.socket() as s:
+        s.bind(( '127.0.0.1', 0 ))
+        return s.getsockname()[1]
+
+def _server_start(requests, tmpdir):
+    # scratch databases, with the users and passwords the traffic
+    # logs in with
+    app_dir = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ)
+    for name in ( 'FSDB', 'USERDB', 'STATE_DIR' ):
+        env[name] = os.path.join(tmpdir, name.lower())
+        os.mkdir(env[name])
+    env.setdefault('SECRET_KEY', 'loadgen')
+    env.setdefault('LOG_LEVEL', 'WARNING')
+    users = {}
+    for request in requests:
+        if request['path'] == '/login':
+            form = request['form']
+            users[form['username']] = form['passwd']
+    for user, password in users.items():
+        subprocess.check_call([
+            sys.executable, os.path.join(app_dir, os.pardir, "ttbd-passwd"),
+            "-p", env['USERDB'], user, password ])
+    port = _port_free()
+    env['BIND'] = f"127.0.0.1:{port}"
+    server = subprocess.Popen(
+        [ sys.executable, "-m", "gunicorn",
+          "--config", "gunicorn.conf.py", "wsgi:app" ],
+        cwd = app_dir, env = env)
+    ts0 = time.time()
+    while True:
+        try:
+            with socket.create_connection(( '127.0.0.1', port ), timeout = 1):
+                break
+        except OSError:
+            if server.poll() != None or time.time() - ts0 > 30:
+                server.kill()
+                raise RuntimeError("gunicorn did not start")
+            time.sleep(0.1)
+    return server, f"http://127.0.0.1:{port}"
+
+def _cmd_synthesize(args):
+    with open(args.output, "w") as f:
+        for request in synthesize(args.sessions, args.requests,
+                                  args.user, args.password, args.seed):
+            f.write(json.dumps(request) + "\n")
+
+def _cmd_replay(args):
+    with open(args.traffic) as f:
+        requests = [ json.loads(line) for line in f if line.strip() ]
+    server = None
+    tmpdir = None
+    try:
+        url = args.url
+        if args.start:
+            tmpdir = tempfile.mkdtemp(prefix = "loadgen-")
+            server, url = _server_start(requests, tmpdir)
+        results, seconds = replay(url, requests, args.concurrency)
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+        if tmpdir:
+            shutil.rmtree(tmpdir, ignore_errors = True)
+
+    r = report(results, seconds)
+    if args.json:
+        json.dump(r, sys.stdout, indent = 2)
+        print()
+        return
+    print("%-22s %8s %6s %9s %9s %9s %9s" % (
+        "route", "requests", "errors", "p50 ms", "p95 ms", "p99 ms", "req/s"))
+    for route, data in sorted(r.items(), key = lambda i: i[0] == 'total'):
+        print("%-22s %8d %6d %9.1f %9.1f %9.1f %9.1f" % (
+            route, data['requests'], data['errors'],
+            data['p50'], data['p95'], data['p99'], data['rps']))
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(
+        description = __doc__.split("\n\n")[0],
+        formatter_class = argparse.RawDescriptionHelpFormatter)
+    subparsers = ap.add_subparsers(required = True)
+
+    ap_synth = subparsers.add_parser(
+        "synthesize", help = "generate synthetic session traffic")
+    ap_synth.add_argument("-o", "--output", default = "traffic.jsonl",
+                          help = "file to write to [%(default)s]")
+    ap_synth.add_argument("--sessions", type = int, default = 100,
+                          help = "number of sessions [%(default)d]")
+    ap_synth.add_argument("--requests", type = int, default = 50,
+                          help = "requests per session after logging in"
+                          " [%(default)d]")
+    ap_synth.add_argument("--user", default = "loadgen",
+                          help = "user to log in as [%(default)s]")
+    ap_synth.add_argument("--password", default = "loadgen",
+                          help = "password to log in with [%(default)s]")
+    ap_synth.add_argument("--seed", type = int, default = None,
+                          help = "random seed, for repeatable traffic")
+    ap_synth.set_defaults(func = _cmd_synthesize)
+
+    ap_replay = subparsers.add_parser(
+        "replay", help = "replay traffic and report latency/throughput")
+    ap_replay.add_argument("traffic", help = "JSONL traffic file")
+    ap_replay.add_argument("-c", "--concurrency", type = int, default = 8,
+                           help = "sessions to run at the same time"
+                           " [%(default)d]")
+    ap_replay.add_argument("--url", default = "http://127.0.0.1:8080",
+                           help = "server to send requests to [%(default)s]")
+    ap_replay.add_argument("--start", action = "store_true", default = False,
+                           help = "start a gunicorn on scratch databases"
+                           " to test against (ignores --url)")
+    ap_replay.add_argument("--json", action = "store_true", default = False,
+                           help = "print the report as JSON")
+    ap_replay.set_defaults(func = _cmd_replay)
+
+    args = ap.parse_args()
+    args.func(args)
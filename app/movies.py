@@ -1,4 +1,5 @@
 #!/usr/bin/env python
+import logging
 import os
 import time
 import json
@@ -6,23 +7,14 @@ import json
 import flask
 import flask_login
 import dotenv
+import markupsafe
 
-import db
+import assets
+import backends
+import compress
 import user_c
-import auth_userdb
 
-dotenv.load_dotenv()
-
-fsdb_path = os.environ.get('FSDB', '/db')
-userdb_path = os.environ.get('USERDB', '/userdb')
-
-fsdb = db.fsdb_symlink_c(fsdb_path)
-userdb = auth_userdb.driver(userdb_path)
-
-app = flask.Flask(__name__)
-app.secret_key = os.environ.get('SECRET_KEY', None)
 login_manager = flask_login.LoginManager()
-login_manager.init_app(app)
 # None means that the cookie will not contain information about
 # the IP address where the login came from. We want to be able to
 # carry our login information while the machine changes IP
@@ -30,6 +22,17 @@ login_manager.init_app(app)
 # https://flask-login.readthedocs.io/en/latest/#session-protection
 login_manager.session_protection = None
 
+# views, registered in each application made by create_app()
+bp = flask.Blueprint('movies', __name__)
+
+def backends_get():
+    """
+    Return the backends of the current application
+
+    :returns backends.backends_c: backends
+    """
+    return flask.current_app.extensions['movies']
+
 @login_manager.user_loader
 def load_user(userid):
     """
@@ -38,70 +41,153 @@ def load_user(userid):
     """
     return user_c.User.search_user(userid)
 
-@app.route('/')
+@bp.route('/')
 def index():
     return flask.render_template('index.html')
 
-@app.route('/login', methods = ['POST'])
+@bp.route('/login', methods = ['POST'])
 def login():
     form = flask.request.form
     username = form.get('username', None)
     password = form.get('passwd', None) #FIXME this should be the hash
 
     try:
-        userdb.login(username, password)
+        backends_get().userdb.login(username, password)
     except Exception as e:
         return "bad login", 401
 
     user = user_c.User(username)
     flask_login.login_user(user, remember = True)
-    return flask.redirect(flask.url_for('movies'))
+    return flask.redirect(flask.url_for('movies.movies'))
 
-@app.route('/movies', methods = ['GET'])
-@flask_login.login_required
-def movies():
-    movies_d = fsdb.get_as_dict()
+def movies_split(generation):
+    """
+    Return the movie list, split in unseen and watched
+
+    The database is read and the lists sorted only once per database
+    generation; the result is shared by all the pages and sections
+    rendered from that generation.
+
+    :param generation: current database generation (see
+      :meth:`db.fsdb_c.generation`), taken before calling
+    :returns tuple(list, list): sorted lists of unseen and watched
+      movies; do not modify
+    """
+    backends = backends_get()
+    movies_lists = backends.movies_lists
+    if movies_lists != None and movies_lists[0] == generation:
+        return movies_lists[1], movies_lists[2]
     unseen = []
     watched = []
-    for movie, status in movies_d.items():
+    # all the movies have to be read anyway: the status is the value
+    for movie, status in backends.fsdb.get_as_dict().items():
         if status: #this means its already watched
             watched.append(movie)
             continue
         unseen.append(movie)
+    # directory order is arbitrary, sort so pages are stable
+    watched.sort()
+    backends.movies_lists = ( generation, unseen, watched )
+    return unseen, watched
 
-    return flask.render_template(
-        'movies.html',
-        movies = unseen,
-        watched = watched,
-    )
+def render_sections(page, sections_wanted = ( 'unseen', 'watched' )):
+    """
+    Render the unseen and/or watched sections of *page* (*movies*
+    or *edit*) using the templates in *fragments/*
 
-@app.route('/edit', methods = ['GET'])
-@flask_login.login_required
-def edit():
-    movies_d = fsdb.get_as_dict()
-    unseen = []
-    watched = []
-    for movie, status in movies_d.items():
-        if status: #this means its already watched
-            watched.append(movie)
+    Cached by database generation, so the database is only read and
+    the lists only rendered when something changed.
+
+    :param list(str) sections_wanted: (optional) which sections to
+      render; defaults to both
+
+    :returns dict: *unseen* and/or *watched* pre-rendered HTML
+    """
+    # take the generation before reading, so if the database changes
+    # while we read, the next request will re-render
+    generation = backends_get().fsdb.generation()
+    fragments = backends_get().fragments
+    sections = {}
+    for index, section in enumerate(( 'unseen', 'watched' )):
+        if section not in sections_wanted:
             continue
-        unseen.append(movie)
+        template = f'fragments/{page}_{section}.html'
+        fragment = fragments.get_or_render(
+            ( generation, template ),
+            lambda: flask.render_template(
+                template, movies = movies_split(generation)[index]))
+        # rendered by Jinja with autoescaping, so it is safe
+        sections[section] = markupsafe.Markup(fragment)
+    return sections
 
-    return flask.render_template(
-        'edit.html',
-        movies = unseen,
-        watched = watched,
-    )
+@bp.route('/movies', methods = ['GET'])
+@flask_login.login_required
+def movies():
+    # watched movies are loaded by the page from /movies/watched when
+    # the user opens them
+    return flask.render_template('movies.html',
+                                 **render_sections('movies', ( 'unseen', )))
+
+def render_watched(page):
+    """
+    Render a page of the watched movies list as an HTML fragment
+
+    If there are more pages, the fragment ends with a placeholder
+    pointing to the next one, which *movies.js* loads when scrolled
+    into view.
+
+    :param int page: page number (from zero)
+    :returns str: rendered HTML; *None* if *page* is past the end
+      of the list (page zero always exists, even if empty)
+    """
+    watched_page_size = flask.current_app.config['WATCHED_PAGE_SIZE']
+    generation = backends_get().fsdb.generation()
+    _unseen, watched = movies_split(generation)
+    # check before caching, otherwise any page number asked for would
+    # take a cache entry
+    if page > 0 and page * watched_page_size >= len(watched):
+        return None
+
+    def _render():
+        start = page * watched_page_size
+        end = start + watched_page_size
+        next_url = None
+        if end < len(watched):
+            next_url = flask.url_for('movies.movies_watched', page = page + 1)
+        return flask.render_template(
+            'fragments/movies_watched.html',
+            movies = watched[start:end],
+            next_url = next_url,
+        )
 
-@app.route('/movies/add', methods = ['POST'])
+    return backends_get().fragments.get_or_render(
+        ( generation, 'fragments/movies_watched.html', page ), _render)
+
+@bp.route('/movies/watched', methods = ['GET'])
+@flask_login.login_required
+def movies_watched():
+    page = flask.request.args.get('page', 0, type = int)
+    if page < 0:
+        return 'bad page', 400
+    fragment = render_watched(page)
+    if fragment == None:
+        return 'no such page', 404
+    return fragment
+
+@bp.route('/edit', methods = ['GET'])
+@flask_login.login_required
+def edit():
+    return flask.render_template('edit.html', **render_sections('edit'))
+
+@bp.route('/movies/add', methods = ['POST'])
 @flask_login.login_required
 def add_movie():
     form = flask.request.form
     movie = form.get('movie', None)
-    fsdb.set(movie, False)
-    return flask.redirect(flask.url_for('movies'))
+    backends_get().fsdb.set(movie, False)
+    return flask.redirect(flask.url_for('movies.movies'))
 
-@app.route('/movies/delete', methods = ['DELETE'])
+@bp.route('/movies/delete', methods = ['DELETE'])
 @flask_login.login_required
 def delete_movie():
     try:
@@ -110,10 +196,10 @@ def delete_movie():
     except Exception:
         return 'couldnt parse json', 400
 
-    fsdb.set(movie, None)
+    backends_get().fsdb.set(movie, None)
     return 'ok', 200
 
-@app.route('/movies/edit', methods = ['PUT'])
+@bp.route('/movies/edit', methods = ['PUT'])
 @flask_login.login_required
 def edit_movie():
     try:
@@ -122,20 +208,97 @@ def edit_movie():
     except Exception:
         return 'couldnt parse json', 400
 
-    fsdb.set(movie, True)
+    backends_get().fsdb.set(movie, True)
     return 'ok', 200
 
-@app.route('/apple-touch-icon.png', methods = ['GET'])
+@bp.route('/apple-touch-icon.png', methods = ['GET'])
 def apple_touch():
     '''
     pretty sure there is a better way to do this
+
+    This URL is fixed, so it can't be fingerprinted like the other
+    assets; let clients cache it for a day.
     '''
     return flask.send_from_directory(
-        os.path.join(app.root_path, 'static'),
+        flask.current_app.static_folder,
         'movies.png',
-        mimetype='image/png'
+        mimetype='image/png',
+        max_age = 24 * 60 * 60,
     )
 
 
+def warm_up(app):
+    """
+    Fill the caches of *app* with the current movie lists
+
+    Meant to be done in the gunicorn master before forking workers
+    (see *gunicorn.conf.py*), so they all start with them.
+    """
+    with app.test_request_context():
+        render_sections('movies', ( 'unseen', ))
+        render_sections('edit')
+        render_watched(0)
+
+def create_app(config = None):
+    """
+    Create the application
+
+    Configuration is taken from the environment (and *.env*), in
+    the variables:
+
+    - *FSDB*: path to the movie database (default */db*)
+    - *USERDB*: path to the user database (default */userdb*)
+    - *STATE_DIR*: where to keep logged in user's state (default
+      */db*)
+    - *SECRET_KEY*: for signing session cookies
+    - *FRAGMENT_CACHE_BYTES*: size of the rendered movie list cache
+      (default 16MiB); entries are invalidated when the movie
+      database directory's modification time changes (see
+      :meth:`db.fsdb_symlink_c.generation`), so *FSDB* has to be in
+      a filesystem with fine grained (sub-second) timestamps, or
+      changes made by other workers might not be seen until the next
+      write
+    - *WATCHED_PAGE_SIZE*: watched movies sent per request (default
+      50)
+    - *LOG_LEVEL*: (default *DEBUG*)
+    - *WARM_UP*: if *true*, fill the caches before returning
+
+    Databases are not opened until used (see
+    :class:`backends.backends_c`).
+
+    :param dict config: (optional) configuration values that
+      override the environment's
+    :returns flask.Flask: application
+    """
+    dotenv.load_dotenv()
+    app = flask.Flask(__name__)
+    app.config.from_mapping(
+        FSDB = os.environ.get('FSDB', '/db'),
+        USERDB = os.environ.get('USERDB', '/userdb'),
+        STATE_DIR = os.environ.get('STATE_DIR', '/db'),
+        SECRET_KEY = os.environ.get('SECRET_KEY', None),
+        FRAGMENT_CACHE_BYTES = int(os.environ.get('FRAGMENT_CACHE_BYTES',
+                                                  16 * 1024 * 1024)),
+        WATCHED_PAGE_SIZE = int(os.environ.get('WATCHED_PAGE_SIZE', 50)),
+        LOG_LEVEL = os.environ.get('LOG_LEVEL', 'DEBUG'),
+        WARM_UP = os.environ.get('WARM_UP', 'false').lower() == 'true',
+    )
+    if config:
+        app.config.update(config)
+    if app.config['WATCHED_PAGE_SIZE'] <= 0:
+        raise ValueError("WATCHED_PAGE_SIZE: must be positive; got %d"
+                         % app.config['WATCHED_PAGE_SIZE'])
+
+    logging.basicConfig(level = app.config['LOG_LEVEL'])
+    app.extensions['movies'] = backends.backends_c(app.config)
+    assets.init_app(app)
+    compress.init_app(app)
+    login_manager.init_app(app)
+    app.register_blueprint(bp)
+
+    if app.config['WARM_UP']:
+        warm_up(app)
+    return app
+
 if __name__=="__main__":
-    app.run(debug=True, host='0.0.0.0')
+    create_app().run(debug=True, host='0.0.0.0')
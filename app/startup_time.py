@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+"""
+Measure how long it takes the application to start
+
+Each run is a fresh interpreter, that measures:
+
+- *import*: importing :mod:`movies`
+- *create_app*: :func:`movies.create_app`, without warm up
+- *first_request*: first request to */* (templates get compiled)
+- *warm_up*: :func:`movies.warm_up` (reads the movie database and
+  renders the lists)
+
+and the median of each is printed, in milliseconds::
+
+  $ FSDB=/tmp/db USERDB=/tmp/userdb python startup_time.py -n 20
+
+For a breakdown of the import time per module, use *python -X
+importtime -c 'import movies'*.
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+_child = r'''
+import json, time
+t0 = time.perf_counter()
+import movies
+t1 = time.perf_counter()
+app = movies.create_app({ 'WARM_UP': False })
+t2 = time.perf_counter()
+app.test_client().get('/')
+t3 = time.perf_counter()
+movies.warm_up(app)
+t4 = time.perf_counter()
+print(json.dumps({
+    'import': t1 - t0,
+    'create_app': t2 - t1,
+    'first_request': t3 - t2,
+    'warm_up': t4 - t3,
+}))
+'''
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description = __doc__.split("\n\n")[0])
+    ap.add_argument("-n", "--runs", type = int, default = 10,
+                    help = "number of runs (default %(default)d)")
+    args = ap.parse_args()
+
+    results = {}
+    for _ in range(args.runs):
+        output = subprocess.check_output([ sys.executable, "-c", _child ],
+                                         stderr = subprocess.DEVNULL)
+        for name, value in json.loads(output).items():
+            results.setdefault(name, []).append(value)
+    for name, values in results.items():
+        print("%-14s %8.1f ms" % (name, statistics.median(values) * 1000))
+    print("%-14s %8.1f ms (median of %d runs)" % (
+        "total", sum(statistics.median(v) for v in results.values()) * 1000,
+        args.runs))
@@ -30,3 +30,62 @@ function put_movie(movie) {
     request.send(JSON.stringify({'movie': movie}));
     window.location.reload();
 }
+
+// watched movies are loaded a page at a time when the list is
+// opened; the last element of each page points to the next one and
+// is replaced by it when scrolled into view
+var watched_observer = null;
+
+function watched_fetch(details, placeholder, url) {
+    var request = new XMLHttpRequest();
+    request.open('GET', url, true);
+    request.onload = function () {
+        if (request.status != 200) {
+            watched_fetch_failed(details, placeholder, url);
+            return;
+        }
+        var template = document.createElement('template');
+        template.innerHTML = request.responseText;
+        if (placeholder)
+            placeholder.remove();
+        details.appendChild(template.content);
+        var more = details.querySelector('p.more');
+        if (more)
+            watched_observer.observe(more);
+    };
+    request.onerror = function () {
+        watched_fetch_failed(details, placeholder, url);
+    };
+    request.send();
+}
+
+// don't retry on our own, it'd hammer a failing server; for the
+// first page, let closing and opening the list again retry; for
+// the next ones, keep the placeholder, offering to retry on click
+function watched_fetch_failed(details, placeholder, url) {
+    if (!placeholder) {
+        delete details.dataset.loaded;
+        return;
+    }
+    placeholder.textContent = 'failed to load, retry';
+    placeholder.onclick = function () {
+        placeholder.onclick = null;
+        placeholder.textContent = '';
+        watched_fetch(details, placeholder, url);
+    };
+}
+
+function watched_load(details) {
+    if (!details.open || details.dataset.loaded)
+        return;
+    details.dataset.loaded = 'yes';
+    watched_observer = new IntersectionObserver(function (entries) {
+        entries.forEach(function (entry) {
+            if (!entry.isIntersecting)
+                return;
+            watched_observer.unobserve(entry.target);
+            watched_fetch(details, entry.target, entry.target.dataset.next);
+        });
+    });
+    watched_fetch(details, null, '/movies/watched?page=0');
+}
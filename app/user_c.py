@@ -1,26 +1,27 @@
 import os
-import dotenv
 
-import db
+import flask
 
-dotenv.load_dotenv()
+import db
 
 class User(object):
-    # Where we save user data so users don't have to re-login
-    state_dir = os.environ.get('STATE_DIR', '/db')
-
     def __init__(self, userid, fail_if_new = False, roles = None):
         path = self.create_filename(userid)
         self.userid = userid
         if not os.path.isdir(path) and fail_if_new == False:
-            db.rm_f(path)	# cleanup, just in case
+            try:
+                db.rm_f(path)	# cleanup, just in case
+            except IsADirectoryError:
+                pass	# another thread/process just created it
             db.makedirs_p(path)
         try:
             self.fsdb = db.fsdb_symlink_c(path)
         except ( AssertionError, db.fsdb_c.exception ) as e:
             if fail_if_new:
                 raise self.user_not_existant_e("%s: no such user" % userid)
-        self.fsdb.set('userid', userid)
+        # this is called on every request (see movies.load_user()),
+        # so only write it the first time
+        self.fsdb.set('userid', userid, force = False)
         if roles:
             assert isinstance(roles, list)
             for role in roles:
@@ -31,6 +32,15 @@ class User(object):
         r['name'] = os.path.basename(self.fsdb.location)
         return r
 
+    def view(self):
+        """
+        Return a lazy, read-only nested view of the user's data
+
+        Like :meth:`to_dict`, but values are only read from the
+        database when accessed; see :class:`db.fsdb_view_c`.
+        """
+        return db.fsdb_view_c(self.fsdb)
+
     def wipe(self):
         """
         Remove the knowledge of the user in the daemon, effectively
@@ -57,9 +67,13 @@ class User(object):
     def create_filename(userid):
         """
         Makes a safe filename based on the user ID
+
+        Users are kept in the current application's *STATE_DIR*,
+        where we save user data so users don't have to re-login.
         """
         filename = "_user_" + db.mkid(userid)
-        return os.path.join(User.state_dir, filename)
+        return os.path.join(flask.current_app.config['STATE_DIR'],
+                            filename)
 
     @staticmethod
     def search_user(userid):
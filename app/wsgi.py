@@ -1,4 +1,6 @@
-from movies import app
+from movies import create_app
+
+app = create_app()
 
 if __name__ == "__main__":
     app.run()